@@ -0,0 +1,69 @@
+import math, bisect
+from datetime import datetime
+import numpy as np
+
+class SampleAligner:
+    """Buffers timestamped samples per column and resamples them onto a fixed time grid.
+
+    Each grid point t gets the last sample in [t - tolerance, t] ('last') or the sample closest to t
+    within +/- tolerance ('nearest'). Columns listed in `extrema_columns` also get the min/max of all
+    samples in the bucket (t - grid, t], stored as '<col>_min' / '<col>_max'.
+    """
+    def __init__(self, columns, extrema_columns=(), grid_seconds=60, method='last', tolerance=None, latency=5):
+        if method not in ('last', 'nearest'): raise ValueError(f"Unknown alignment method '{method}'")
+        self.columns = list(columns); self.extrema_columns = [c for c in extrema_columns if c in self.columns]
+        self.grid = float(grid_seconds); self.method = method; self.latency = latency
+        self.tolerance = float(tolerance) if tolerance is not None else 2 * self.grid
+        self._ts = {c: [] for c in self.columns}; self._vals = {c: [] for c in self.columns}
+        self._next_grid = None
+
+    def add(self, column, ts, value):
+        if column not in self._ts: return
+        if self._next_grid is None: self._next_grid = math.ceil(ts / self.grid) * self.grid
+        self._ts[column].append(ts); self._vals[column].append(np.nan if value is None else float(value))
+
+    def build_rows(self, now):
+        """Returns [(iso_timestamp, {column: value})] for every grid point that can no longer receive samples."""
+        if self._next_grid is None: return []
+        ready_until = now - self.latency - (self.tolerance if self.method == 'nearest' else 0)
+        if ready_until < self._next_grid: return []
+        grid = self._next_grid + self.grid * np.arange(int((ready_until - self._next_grid) // self.grid) + 1)
+        values = {}
+        for col in self.columns:
+            ts, vals = np.asarray(self._ts[col], dtype=float), np.asarray(self._vals[col], dtype=float)
+            if ts.size and np.any(np.diff(ts) < 0): order = np.argsort(ts, kind='stable'); ts, vals = ts[order], vals[order]
+            values[col] = self._as_of(ts, vals, grid)
+            if col in self.extrema_columns: values[f"{col}_min"], values[f"{col}_max"] = self._bucket_extrema(ts, vals, grid)
+        rows = []
+        for k, g in enumerate(grid):
+            row = {col: (None if np.isnan(v[k]) else float(v[k])) for col, v in values.items()}
+            if any(v is not None for v in row.values()): rows.append((datetime.fromtimestamp(g).isoformat(), row))
+        self._next_grid = grid[-1] + self.grid; self._prune(grid[-1] - self.tolerance)
+        return rows
+
+    def _as_of(self, ts, vals, grid):
+        out = np.full(grid.size, np.nan)
+        if ts.size == 0: return out
+        idx = np.searchsorted(ts, grid, side='right') - 1
+        if self.method == 'nearest':
+            right = np.minimum(idx + 1, ts.size - 1)
+            use_right = (idx < 0) | (np.abs(ts[right] - grid) < np.abs(grid - ts[np.maximum(idx, 0)]))
+            idx = np.where(use_right, right, idx)
+        valid = (idx >= 0) & (np.abs(grid - ts[np.maximum(idx, 0)]) <= self.tolerance)
+        out[valid] = vals[idx[valid]]
+        return out
+
+    def _bucket_extrema(self, ts, vals, grid):
+        lo_out, hi_out = np.full(grid.size, np.nan), np.full(grid.size, np.nan)
+        lo = np.searchsorted(ts, grid - self.grid, side='right'); hi = np.searchsorted(ts, grid, side='right')
+        filled = hi > lo
+        if not filled.any(): return lo_out, hi_out
+        # Buckets are contiguous, so reduceat over the non-empty bucket starts covers exactly each bucket.
+        window = vals[:hi[filled][-1]]
+        lo_out[filled] = np.fmin.reduceat(window, lo[filled]); hi_out[filled] = np.fmax.reduceat(window, lo[filled])
+        return lo_out, hi_out
+
+    def _prune(self, cutoff):
+        for col in self.columns:
+            keep = bisect.bisect_left(self._ts[col], cutoff)
+            if keep: del self._ts[col][:keep]; del self._vals[col][:keep]
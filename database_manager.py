@@ -7,25 +7,34 @@ class DatabaseManager:
         self.db_path = db_path
         self.config = config
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL") # Readers (/history, replay) then never block the logger's commits
         self.is_dual_current = 'i_mon_low' in self.config['caen_hv_settings']['parameters']
         self._check_and_update_schema()
+        self._last_snapshot = self._load_last_snapshot()
+        self._close_open_outages()
 
     def _get_expected_columns(self):
+        columns = []
+        current_columns = {c for ch in self.config['caen_hv_settings']['channels_to_monitor'] for c in self.get_current_columns(ch)}
+        for name in self.get_sample_columns():
+            columns.append(f"{name} REAL")
+            if name in current_columns: columns.extend([f"{name}_min REAL", f"{name}_max REAL"])
+        return columns
+
+    def get_sample_columns(self):
+        """Names of the columns that hold one sensor/HV reading each (without the derived _min/_max columns)."""
         columns = []
         for sensor in self.config['arduino_settings']['sensors']:
             name = sensor['name'].replace(" ", "_")
-            columns.append(f"{name}_T REAL")
-            columns.append(f"{name}_H REAL")
-        
+            columns.extend([f"{name}_T", f"{name}_H"])
         for ch in self.config['caen_hv_settings']['channels_to_monitor']:
-            columns.append(f"Ch{ch}_V REAL")
-            if self.is_dual_current:
-                columns.append(f"Ch{ch}_I_L REAL")
-                columns.append(f"Ch{ch}_I_H REAL")
-            else:
-                columns.append(f"Ch{ch}_I REAL")
+            columns.append(f"Ch{ch}_V"); columns.extend(self.get_current_columns(ch))
         return columns
 
+    def get_current_columns(self, ch):
+        """Current columns of a channel; these also keep per-bucket min/max so short spikes survive downsampling."""
+        return [f"Ch{ch}_I_L", f"Ch{ch}_I_H"] if self.is_dual_current else [f"Ch{ch}_I"]
+
     def _check_and_update_schema(self):
         cursor = self.conn.cursor()
         cursor.execute("CREATE TABLE IF NOT EXISTS monitoring_data (timestamp TEXT PRIMARY KEY)")
@@ -37,31 +46,93 @@ class DatabaseManager:
             if col_name not in existing_columns:
                 print(f"Schema mismatch: Adding column '{col_name}' to database.")
                 cursor.execute(f"ALTER TABLE monitoring_data ADD COLUMN {col_def}")
+        cursor.execute("CREATE TABLE IF NOT EXISTS hv_stats (timestamp TEXT, ch INTEGER, stat TEXT, value REAL, PRIMARY KEY (timestamp, ch, stat))")
+        cursor.execute("CREATE TABLE IF NOT EXISTS hv_outages (start TEXT PRIMARY KEY, end TEXT, duration_s REAL, reason TEXT)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS hv_param_snapshots (ch INTEGER, param TEXT, timestamp TEXT, value, PRIMARY KEY (ch, param, timestamp))")
         self.conn.commit()
 
-    def log_data(self, data_point):
+    def _close_open_outages(self):
+        """Outages left open by a crash or unclean exit end at the last time the app was still writing data."""
         cursor = self.conn.cursor()
-        cols, values, placeholders = ['timestamp'], [data_point['ts']], ['?']
-        
-        for i, sensor in enumerate(self.config['arduino_settings']['sensors']):
-            name = sensor['name'].replace(" ", "_")
-            s_data = data_point['sensors'].get(i, {'t': None, 'h': None})
-            cols.extend([f'{name}_T', f'{name}_H']); values.extend([s_data['t'], s_data['h']]); placeholders.extend(['?', '?'])
+        cursor.execute("SELECT start, reason FROM hv_outages WHERE end IS NULL")
+        for start, reason in cursor.fetchall():
+            cursor.execute("SELECT MAX(ts) FROM (SELECT MAX(timestamp) AS ts FROM monitoring_data WHERE timestamp >= ? UNION ALL SELECT MAX(timestamp) FROM hv_stats WHERE timestamp >= ?)", (start, start))
+            end = cursor.fetchone()[0] or start
+            cursor.execute("UPDATE hv_outages SET end = ?, duration_s = ?, reason = ? WHERE start = ?", (end, (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds(), f"{reason} (app exited during outage)", start))
+        self.conn.commit()
 
-        for ch in self.config['caen_hv_settings']['channels_to_monitor']:
-            hv_data = data_point['hv'].get(ch, {})
-            cols.append(f'Ch{ch}_V'); values.append(hv_data.get('v')); placeholders.append('?')
-            if self.is_dual_current:
-                cols.extend([f'Ch{ch}_I_L', f'Ch{ch}_I_H']); values.extend([hv_data.get('il'), hv_data.get('ih')]); placeholders.extend(['?', '?'])
-            else:
-                cols.append(f'Ch{ch}_I'); values.append(hv_data.get('i')); placeholders.append('?')
-        
-        sql = f"INSERT OR REPLACE INTO monitoring_data ({', '.join(cols)}) VALUES ({', '.join(placeholders)})"
+    def _load_last_snapshot(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT ch, param, value, MAX(timestamp) FROM hv_param_snapshots GROUP BY ch, param")
+        return {(ch, param): value for ch, param, value, _ in cursor.fetchall()}
+
+    def log_rows(self, rows):
+        """Writes aligned rows [(timestamp, {column: value})] produced by SampleAligner. Returns False if nothing was written."""
+        if not rows: return True
+        try:
+            for ts, values in rows:
+                cols = ['timestamp'] + list(values)
+                self.conn.execute(f"INSERT OR REPLACE INTO monitoring_data ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", [ts] + list(values.values()))
+            self.conn.commit(); return True
+        except sqlite3.Error as e:
+            self.conn.rollback(); print(f"Database log error: {e}"); return False
+
+    def log_stats(self, ts, stats):
+        """Stores the online current statistics {ch: {stat: value}} computed by HvStatsTracker."""
+        rows = [(ts, ch, stat, value) for ch, values in stats.items() for stat, value in values.items()]
+        if not rows: return
         try:
-            cursor.execute(sql, values)
+            self.conn.executemany("INSERT OR REPLACE INTO hv_stats (timestamp, ch, stat, value) VALUES (?, ?, ?, ?)", rows)
             self.conn.commit()
         except sqlite3.Error as e:
-            print(f"Database log error: {e}")
+            print(f"Database stats log error: {e}")
+
+    def fetch_stats_range(self, start_dt, end_dt):
+        """Returns {ch: {stat: (timestamps, values)}} without re-scanning monitoring_data."""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT timestamp, ch, stat, value FROM hv_stats WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp", (start_dt, end_dt))
+        stats = {}
+        for ts, ch, stat, value in cursor.fetchall():
+            series = stats.setdefault(ch, {}).setdefault(stat, ([], []))
+            series[0].append(datetime.fromisoformat(ts).timestamp()); series[1].append(value)
+        return stats
+
+    def log_snapshot(self, ts, snapshot):
+        """Stores only the parameters whose value changed since the previous snapshot; a failed read is stored as NULL."""
+        rows = []
+        for ch, values in snapshot.items():
+            for param, value in values.items():
+                if self._last_snapshot.get((ch, param), object()) != value: rows.append((ch, param, ts, value))
+        if not rows: return 0
+        try:
+            self.conn.executemany("INSERT OR REPLACE INTO hv_param_snapshots (ch, param, timestamp, value) VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Database snapshot error: {e}"); return 0
+        for ch, param, _, value in rows: self._last_snapshot[(ch, param)] = value
+        return len(rows)
+
+    def fetch_snapshot_at(self, ts):
+        """Rebuilds the full crate state {ch: {param: value}} as it was at the given ISO timestamp. None means the read failed."""
+        cursor = self.conn.cursor(); state = {}
+        for ch, param in sorted(self._last_snapshot):
+            cursor.execute("SELECT value FROM hv_param_snapshots WHERE ch = ? AND param = ? AND timestamp <= ? ORDER BY timestamp DESC LIMIT 1", (ch, param, ts))
+            row = cursor.fetchone()
+            if row: state.setdefault(ch, {})[param] = row[0]
+        return state
+
+    def log_outage(self, outage):
+        """Records an HV data gap; an open outage (end is None) is updated in place once it ends."""
+        try:
+            self.conn.execute("INSERT OR REPLACE INTO hv_outages (start, end, duration_s, reason) VALUES (?, ?, ?, ?)", (outage['start'], outage['end'], outage['duration_s'], outage['reason']))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Database outage log error: {e}")
+
+    def fetch_outages(self, start_dt, end_dt):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT start, end, duration_s, reason FROM hv_outages WHERE start <= ? AND (end IS NULL OR end >= ?) ORDER BY start", (end_dt, start_dt))
+        return [{'start': row[0], 'end': row[1], 'duration_s': row[2], 'reason': row[3]} for row in cursor.fetchall()]
 
     def fetch_data_range(self, start_dt, end_dt):
         cursor = self.conn.cursor()
@@ -7,6 +7,9 @@ import pyqtgraph as pg
 import numpy as np
 from worker_manager import WorkerManager
 from database_manager import DatabaseManager
+from data_aligner import SampleAligner
+from online_stats import HvStatsTracker
+from stream_server import LiveStreamServer
 
 class HVControlPanel(QDialog):
     control_signal = pyqtSignal(str, int, int, str, object)
@@ -48,9 +51,10 @@ class HVControlPanel(QDialog):
         if ch in settings: self.voltage_input.setValue(settings[ch]['v_set']); self.current_input.setValue(settings[ch]['i_set'])
 
 class MonitoringApp(QMainWindow):
-    def __init__(self, config):
+    def __init__(self, config, worker_manager=None, clock=time.time, time_scale=1.0):
         super().__init__()
         self.config = config; self.styles = config['ui_styles']
+        self.clock = clock; self.time_scale = time_scale # Replay mode drives the app with a virtual clock and faster timers
         self.latest_data = {'sensors': {}, 'hv': {}}
         self.graph_data = {'time': [], 'temp': {}, 'humi': {}, 'volt': {}, 'curr': {}}
         self.is_dual_current = 'i_mon_low' in self.config['caen_hv_settings']['parameters']
@@ -58,10 +62,22 @@ class MonitoringApp(QMainWindow):
         self.plot_colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
         self._is_closing = False
         self.db_manager = DatabaseManager(f"{config['logging_options']['log_file_prefix']}.db", config)
-        self.worker_manager = WorkerManager(self.config)
-        self.setup_ui(); self.connect_signals(); self.setup_timers()
+        self.setup_aligner()
+        stats_opts = config.get('stats_options', {}) # Dual-current boards default to the finer low range, which resolves slow leakage drift
+        self.hv_stats = HvStatsTracker(self.config['caen_hv_settings']['channels_to_monitor'], stats_opts.get('current_key', 'il' if self.is_dual_current else 'i'), stats_opts)
+        self.worker_manager = worker_manager or WorkerManager(self.config)
+        self.setup_ui(); self.connect_signals(); self.setup_timers(); self.setup_stream_server()
         self.worker_manager.start_workers()
 
+    def setup_aligner(self):
+        log_opts = self.config['logging_options']; self.grid_seconds = log_opts.get('grid_seconds', 60)
+        self.sensor_columns = {i: s['name'].replace(" ", "_") for i, s in enumerate(self.config['arduino_settings']['sensors'])}
+        self.hv_column_suffixes = {'v': 'V', 'i': 'I', 'il': 'I_L', 'ih': 'I_H'}
+        sample_cols = self.db_manager.get_sample_columns()
+        current_cols = [c for ch in self.config['caen_hv_settings']['channels_to_monitor'] for c in self.db_manager.get_current_columns(ch)]
+        self._unlogged_rows = []
+        self.aligner = SampleAligner(sample_cols, current_cols, grid_seconds=self.grid_seconds, method=log_opts.get('align_method', 'last'), tolerance=log_opts.get('align_tolerance'), latency=log_opts.get('align_latency', 5))
+
     def setup_ui(self):
         self.setWindowTitle(self.config['ui_options']['window_title']); self.setGeometry(100, 100, 1800, 950)
         self.setStyleSheet(f"background-color: {self.styles['background_color']};")
@@ -101,6 +117,12 @@ class MonitoringApp(QMainWindow):
             if self.is_dual_current:
                 status_layout.addWidget(QLabel(f"Ch{ch}:"), base_row + 1, col_offset); status_layout.addWidget(self.hv_labels[ch]['ih'], base_row + 1, col_offset+1); status_layout.addWidget(QLabel(f"Ch{ch}:"), base_row + 2, col_offset); status_layout.addWidget(self.hv_labels[ch]['il'], base_row + 2, col_offset+1)
             else: status_layout.addWidget(QLabel(f"Ch{ch}:"), base_row + 1, col_offset); status_layout.addWidget(self.hv_labels[ch]['i'], base_row + 1, col_offset+1)
+        stats_row = base_row + (3 if self.is_dual_current else 2)
+        stats_header = QLabel("EWMA (CUSUM):"); stats_header.setFont(font_large); stats_header.setStyleSheet(f"color: {self.styles['font_color_current']}; font-weight: bold;"); status_layout.addWidget(stats_header, stats_row, 0, 1, 2)
+        self.stats_labels = {}
+        for i, ch in enumerate(self.config['caen_hv_settings']['channels_to_monitor']):
+            self.stats_labels[ch] = QLabel("-"); self.stats_labels[ch].setFont(font_large)
+            status_layout.addWidget(QLabel(f"Ch{ch}:"), stats_row, (i * 2) + 2); status_layout.addWidget(self.stats_labels[ch], stats_row, (i * 2) + 3)
         graph_widget = QWidget(); graph_layout = QGridLayout(graph_widget)
         self.monitor_plots = {k: pg.PlotWidget(axisItems={'bottom': pg.DateAxisItem(orientation='bottom')}) for k in ['temp', 'humi', 'volt', 'curr']}
         for p in self.monitor_plots.values(): p.addLegend()
@@ -148,20 +170,37 @@ class MonitoringApp(QMainWindow):
         self.worker_manager.arduino_data_ready.connect(self.update_arduino_data); self.worker_manager.caenhv_data_ready.connect(self.update_caenhv_data)
         self.worker_manager.arduino_status_changed.connect(lambda s: self.env_status_label.setText(f"ENV Status: {s}")); self.worker_manager.caenhv_status_changed.connect(self.hv_status_label.setText)
         self.worker_manager.hv_command_feedback.connect(self.on_hv_feedback); self.worker_manager.hv_initial_settings_ready.connect(self.on_hv_initial_settings_ready)
+        self.worker_manager.hv_snapshot_ready.connect(self.on_hv_snapshot_ready); self.worker_manager.hv_outage_recorded.connect(self.on_hv_outage_recorded)
         self.control_panel_btn.clicked.connect(self.open_control_panel); self.worker_manager.shutdown_complete.connect(self.close)
     
+    def setup_stream_server(self):
+        self.stream_server = None
+        if not self.config.get('stream_server', {}).get('enabled'): return
+        self.stream_server = LiveStreamServer(self.config, self.db_manager.db_path, self)
+        self.worker_manager.arduino_data_ready.connect(self.stream_server.on_arduino_data); self.worker_manager.caenhv_data_ready.connect(self.stream_server.on_caenhv_data)
+        try: self.stream_server.start()
+        except OSError as e: print(f"Live stream server could not start: {e}"); self.stream_server = None
+
     def setup_timers(self):
-        self.indicator_timer = QTimer(self); self.indicator_timer.timeout.connect(self.update_indicators); self.indicator_timer.start(2000)
-        self.capture_timer = QTimer(self); self.capture_timer.timeout.connect(self.capture_data_point); self.capture_timer.start(60000)
-        self.graph_timer = QTimer(self); self.graph_timer.timeout.connect(self.update_graphs); self.graph_timer.start(60000)
-        self.datetime_timer = QTimer(self); self.datetime_timer.timeout.connect(lambda: self.datetime_label.setText(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))); self.datetime_timer.start(1000)
+        self.indicator_timer = QTimer(self); self.indicator_timer.timeout.connect(self.update_indicators); self.indicator_timer.start(self._scaled_ms(2000))
+        self.capture_timer = QTimer(self); self.capture_timer.timeout.connect(self.capture_data_point); self.capture_timer.start(self._scaled_ms(self.grid_seconds * 1000))
+        self.graph_timer = QTimer(self); self.graph_timer.timeout.connect(self.update_graphs); self.graph_timer.start(self._scaled_ms(60000))
+        self.datetime_timer = QTimer(self); self.datetime_timer.timeout.connect(lambda: self.datetime_label.setText(datetime.fromtimestamp(self.clock()).strftime('%Y-%m-%d %H:%M:%S'))); self.datetime_timer.start(self._scaled_ms(1000))
 
-    def update_arduino_data(self, idx, temp, humi): self.latest_data['sensors'][idx] = {'t': np.nan if temp is None else temp, 'h': np.nan if humi is None else humi}
+    def _scaled_ms(self, interval_ms): return max(1, int(interval_ms / self.time_scale))
+
+    def update_arduino_data(self, idx, temp, humi):
+        self.latest_data['sensors'][idx] = {'t': np.nan if temp is None else temp, 'h': np.nan if humi is None else humi}
+        if idx in self.sensor_columns:
+            ts = self.clock(); self.aligner.add(f"{self.sensor_columns[idx]}_T", ts, temp); self.aligner.add(f"{self.sensor_columns[idx]}_H", ts, humi)
     def update_caenhv_data(self, results):
         for data_dict in results:
-            ch = data_dict['ch']; self.latest_data['hv'][ch] = data_dict
+            ch = data_dict['ch']; self.latest_data['hv'][ch] = data_dict; ts = data_dict.get('ts', self.clock())
+            for key, suffix in self.hv_column_suffixes.items():
+                if key in data_dict: self.aligner.add(f"Ch{ch}_{suffix}", ts, data_dict[key])
             for key in ['v', 'i', 'il', 'ih']:
                 if key in self.latest_data['hv'][ch] and self.latest_data['hv'][ch][key] is None: self.latest_data['hv'][ch][key] = np.nan
+        self.hv_stats.update(results)
 
     def update_indicators(self):
         for i, data in self.latest_data['sensors'].items():
@@ -171,9 +210,14 @@ class MonitoringApp(QMainWindow):
             self.hv_labels[ch]['v'].setText(f"{data.get('v', 0):.2f}")
             if self.is_dual_current: self.hv_labels[ch]['il'].setText(f"{data.get('il', 0):.4f}"); self.hv_labels[ch]['ih'].setText(f"{data.get('ih', 0):.4f}")
             else: self.hv_labels[ch]['i'].setText(f"{data.get('i', 0):.4f}")
+        for ch, stats in self.hv_stats.channels.items():
+            if stats.ewma is None: continue
+            cusum_text = f"{max(stats.cusum_pos, stats.cusum_neg):.1f}" if stats.baseline is not None else "-"
+            self.stats_labels[ch].setText(f"{stats.ewma:.4f} ({cusum_text})")
+            self.stats_labels[ch].setStyleSheet("color: red; font-weight: bold;" if stats.drifting else f"color: {self.styles['font_color_current']};")
 
     def update_graphs(self):
-        ts = time.time(); self.graph_data['time'].append(ts); max_points = 1440 
+        ts = self.clock(); self.graph_data['time'].append(ts); max_points = 1440 
         if len(self.graph_data['time']) > max_points: self.graph_data['time'].pop(0)
         for i, s_info in enumerate(self.config['arduino_settings']['sensors']):
             data = self.latest_data['sensors'].get(i, {'t': np.nan, 'h': np.nan})
@@ -193,8 +237,8 @@ class MonitoringApp(QMainWindow):
 
     def capture_data_point(self):
         if self._is_closing: return
-        data_point = {'ts': datetime.now().isoformat(), 'sensors': self.latest_data['sensors'].copy(), 'hv': self.latest_data['hv'].copy()}
-        self.db_manager.log_data(data_point)
+        rows = self._unlogged_rows + self.aligner.build_rows(self.clock()) # Rows of a failed write (e.g. database locked) are retried, not lost
+        self._unlogged_rows = [] if self.db_manager.log_rows(rows) else rows; self.db_manager.log_stats(datetime.fromtimestamp(self.clock()).isoformat(), self.hv_stats.snapshot())
         cursor = self.db_manager.conn.cursor(); cursor.execute("SELECT COUNT(*) FROM monitoring_data"); count = cursor.fetchone()[0]
         self.log_status_label.setText(f"Logging: {count} point(s) collected")
 
@@ -213,6 +257,10 @@ class MonitoringApp(QMainWindow):
             elif '_V' in name: self.analysis_plots['volt'].plot(timestamps, values, pen=pen, name=name.replace('_', ' '))
             elif '_I' in name: self.analysis_plots['curr'].plot(timestamps, values, pen=pen, name=name.replace('_', ' '))
             color_idx += 1
+        for outage in self.db_manager.fetch_outages(start_str, end_str):
+            span = [max(datetime.fromisoformat(outage['start']).timestamp(), timestamps[0]), min(datetime.fromisoformat(outage['end']).timestamp(), timestamps[-1]) if outage['end'] else timestamps[-1]]
+            if span[0] >= span[1]: continue
+            for key in ['volt', 'curr']: self.analysis_plots[key].addItem(pg.LinearRegionItem(span, movable=False, brush=pg.mkBrush(255, 0, 0, 40)))
 
     def export_analysis_to_csv(self):
         path, _ = QFileDialog.getSaveFileName(self, "Save CSV", f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", "CSV Files (*.csv)")
@@ -241,11 +289,18 @@ class MonitoringApp(QMainWindow):
     def on_hv_initial_settings_ready(self, settings):
         if hasattr(self, 'control_panel'): self.control_panel.set_initial_values(settings)
 
+    def on_hv_snapshot_ready(self, ts, snapshot):
+        if not self._is_closing: self.db_manager.log_snapshot(ts, snapshot)
+    def on_hv_outage_recorded(self, outage):
+        if not self._is_closing: self.db_manager.log_outage(outage)
+
     def closeEvent(self, event):
         if self._is_closing: event.accept(); return
         print("Close button pressed. Initiating shutdown...")
+        self.worker_manager.end_outage("ended by shutdown") # Logged before the database is closed
         self._is_closing = True; event.ignore(); self.setEnabled(False)
         for timer in [self.indicator_timer, self.capture_timer, self.graph_timer, self.datetime_timer]: timer.stop()
+        if self.stream_server: self.stream_server.stop()
         self.db_manager.close()
         self.worker_manager.initiate_shutdown()
 
@@ -0,0 +1,83 @@
+import math
+from collections import deque
+
+class RollingWelford:
+    """Mean/variance over the last `window` samples, updated in O(1) per sample."""
+    def __init__(self, window):
+        self.window = window; self._values = deque(); self.mean = 0.0; self._m2 = 0.0
+
+    def add(self, x):
+        if len(self._values) == self.window: self._remove(self._values.popleft())
+        self._values.append(x); n = len(self._values)
+        delta = x - self.mean; self.mean += delta / n; self._m2 += delta * (x - self.mean)
+
+    def _remove(self, x):
+        n = len(self._values)
+        if n == 0: self.mean, self._m2 = 0.0, 0.0; return
+        delta = x - self.mean; self.mean -= delta / n; self._m2 = max(self._m2 - delta * (x - self.mean), 0.0)
+
+    @property
+    def count(self): return len(self._values)
+    @property
+    def full(self): return len(self._values) == self.window
+    @property
+    def std(self): return math.sqrt(self._m2 / (len(self._values) - 1)) if len(self._values) > 1 else 0.0
+
+class ChannelStats:
+    """Streaming statistics of one HV channel current: rolling Welford windows, EWMA and a CUSUM drift score.
+
+    The CUSUM reference (baseline mean/sigma) is frozen once the longest window has filled, so a slow
+    drift accumulates in the score instead of being absorbed by the rolling mean. Everything is reset
+    when the channel voltage moves away from the baseline voltage, since the current then has a new level.
+    IMon readings are quantized, so `min_sigma` should be the readout resolution: a steady channel otherwise
+    freezes a near-zero sigma and a single one-step flip looks like a huge deviation.
+    """
+    def __init__(self, windows=(30, 300, 1800), ewma_alpha=0.05, cusum_k=0.5, cusum_h=8.0, voltage_tolerance=5.0, min_sigma=0.05):
+        self.window_sizes = sorted(windows); self.ewma_alpha = ewma_alpha
+        self.cusum_k, self.cusum_h = cusum_k, cusum_h; self.voltage_tolerance, self.min_sigma = voltage_tolerance, min_sigma
+        self.reset()
+
+    def reset(self):
+        self.windows = {w: RollingWelford(w) for w in self.window_sizes}
+        self.ewma = None; self.baseline = None; self.baseline_voltage = None; self.cusum_pos, self.cusum_neg = 0.0, 0.0
+
+    def update(self, current, voltage=None):
+        if current is None or math.isnan(current): return
+        if voltage is not None and not math.isnan(voltage):
+            if self.baseline_voltage is not None and abs(voltage - self.baseline_voltage) > self.voltage_tolerance: self.reset()
+            if self.baseline_voltage is None: self.baseline_voltage = voltage
+        for stats in self.windows.values(): stats.add(current)
+        self.ewma = current if self.ewma is None else self.ewma + self.ewma_alpha * (current - self.ewma)
+        longest = self.windows[self.window_sizes[-1]]
+        if self.baseline is None:
+            if longest.full: self.baseline = (longest.mean, max(longest.std, self.min_sigma))
+            return
+        z = (current - self.baseline[0]) / self.baseline[1]
+        self.cusum_pos = max(0.0, self.cusum_pos + z - self.cusum_k); self.cusum_neg = max(0.0, self.cusum_neg - z - self.cusum_k)
+
+    @property
+    def drifting(self): return self.cusum_pos > self.cusum_h or self.cusum_neg > self.cusum_h
+
+    def as_dict(self):
+        values = {}
+        for w, stats in self.windows.items():
+            if stats.count: values[f"mean_{w}"], values[f"std_{w}"] = stats.mean, stats.std
+        if self.ewma is not None: values['ewma'] = self.ewma
+        if self.baseline is not None: values['cusum_pos'], values['cusum_neg'] = self.cusum_pos, self.cusum_neg
+        return values
+
+class HvStatsTracker:
+    """Keeps ChannelStats for every monitored channel and feeds them from CAEN worker results."""
+    def __init__(self, channels, current_key, options=None):
+        options = options or {}; self.current_key = current_key
+        kwargs = {k: options[k] for k in ('ewma_alpha', 'cusum_k', 'cusum_h', 'voltage_tolerance', 'min_sigma') if k in options}
+        if 'windows' in options: kwargs['windows'] = options['windows']
+        self.channels = {ch: ChannelStats(**kwargs) for ch in channels}
+
+    def update(self, results):
+        for data_dict in results:
+            stats = self.channels.get(data_dict['ch'])
+            if stats is not None: stats.update(data_dict.get(self.current_key), data_dict.get('v'))
+
+    def snapshot(self):
+        return {ch: stats.as_dict() for ch, stats in self.channels.items()}
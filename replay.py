@@ -0,0 +1,122 @@
+import sys, os, csv, time, signal, sqlite3, argparse, copy
+from datetime import datetime
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+
+class ReplayClock:
+    """Virtual clock: starts at `start_ts` and advances `speed` times faster than wall time."""
+    def __init__(self, start_ts, speed):
+        self.start_ts = start_ts; self.speed = speed; self._t0 = None; self._pinned = None
+    def start(self): self._t0 = time.monotonic()
+    def pin(self, ts): self._pinned = ts # While a row is emitted, handlers see exactly the row's timestamp
+    def unpin(self): self._pinned = None
+    def __call__(self):
+        if self._pinned is not None: return self._pinned
+        if self._t0 is None: return self.start_ts
+        return self.start_ts + (time.monotonic() - self._t0) * self.speed
+
+def _to_float(value):
+    if value is None or value == '': return None
+    try: return float(value)
+    except (TypeError, ValueError): return None
+
+def load_rows_from_db(db_path, start_dt, end_dt):
+    """Reads [(ts, {column: value})] from monitoring_data without modifying the source file."""
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute("SELECT * FROM monitoring_data WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp", (start_dt, end_dt))
+        columns = [description[0] for description in cursor.description]
+        return [(datetime.fromisoformat(row[0]).timestamp(), dict(zip(columns[1:], row[1:]))) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def load_rows_from_csv(csv_path, start_dt=None, end_dt=None):
+    """Reads an analysis-tab CSV export (first column 'timestamp')."""
+    rows = []
+    with open(csv_path, newline='') as f:
+        for record in csv.DictReader(f):
+            ts_str = record.pop('timestamp')
+            if (start_dt and ts_str < start_dt) or (end_dt and ts_str > end_dt): continue
+            rows.append((datetime.fromisoformat(ts_str).timestamp(), {col: _to_float(v) for col, v in record.items()}))
+    rows.sort(key=lambda r: r[0])
+    return rows
+
+class ReplayWorkerManager(QObject):
+    """Drop-in replacement for WorkerManager that feeds recorded rows through the same signals."""
+    arduino_data_ready = pyqtSignal(int, object, object); caenhv_data_ready = pyqtSignal(list)
+    arduino_status_changed = pyqtSignal(str); caenhv_status_changed = pyqtSignal(str)
+    hv_command_feedback = pyqtSignal(str); hv_initial_settings_ready = pyqtSignal(dict)
+    hv_snapshot_ready = pyqtSignal(str, object); hv_outage_recorded = pyqtSignal(object)
+    shutdown_complete = pyqtSignal(); replay_finished = pyqtSignal()
+
+    def __init__(self, config, rows, clock, parent=None):
+        super().__init__(parent); self.config = config; self.rows = rows; self.clock = clock; self._next_row = 0
+        self.sensor_columns = [s['name'].replace(" ", "_") for s in config['arduino_settings']['sensors']]
+        params = config['caen_hv_settings']['parameters']
+        self.hv_keys = {'il': 'I_L', 'ih': 'I_H'} if 'i_mon_low' in params else {'i': 'I'}
+        self.timer = QTimer(self); self.timer.timeout.connect(self._emit_due_rows)
+
+    def start_workers(self):
+        status = f"Replay: {len(self.rows)} row(s) at {self.clock.speed:g}x"
+        self.arduino_status_changed.emit(status); self.caenhv_status_changed.emit(f"HV {status}")
+        self.clock.start(); self.timer.start(20)
+
+    def _emit_due_rows(self):
+        now = self.clock()
+        while self._next_row < len(self.rows) and self.rows[self._next_row][0] <= now:
+            ts, values = self.rows[self._next_row]; self._next_row += 1
+            self.clock.pin(ts)
+            try: self._emit_row(ts, values)
+            finally: self.clock.unpin()
+        if self._next_row >= len(self.rows):
+            self.timer.stop(); self.caenhv_status_changed.emit("HV Replay: finished"); self.replay_finished.emit()
+
+    def _emit_row(self, ts, values):
+        for idx, name in enumerate(self.sensor_columns):
+            temp, humi = values.get(f"{name}_T"), values.get(f"{name}_H")
+            if temp is not None or humi is not None: self.arduino_data_ready.emit(idx, temp, humi)
+        results = []
+        for ch in self.config['caen_hv_settings']['channels_to_monitor']:
+            sample = {'ch': ch, 'v': values.get(f"Ch{ch}_V"), 'ts': ts}
+            for key, suffix in self.hv_keys.items(): sample[key] = values.get(f"Ch{ch}_{suffix}")
+            if any(sample[key] is not None for key in ['v'] + list(self.hv_keys)): results.append(sample)
+        if results: self.caenhv_data_ready.emit(results)
+
+    def end_outage(self, note=None): pass
+
+    def initiate_shutdown(self):
+        self.timer.stop(); QTimer.singleShot(0, self.shutdown_complete.emit)
+
+    def queue_hv_command(self, command_type, slot, ch, param_name, value):
+        self.hv_command_feedback.emit("Replay mode: HV commands are disabled")
+
+def main(argv=None):
+    from monitoring_app import MonitoringApp, load_config
+    parser = argparse.ArgumentParser(description="Replay recorded monitoring data through the live monitor.")
+    parser.add_argument('config', help="config file used for the recording")
+    parser.add_argument('--db', help="source SQLite file (default: <log_file_prefix>.db from the config)")
+    parser.add_argument('--csv', help="replay an analysis-tab CSV export instead of the database")
+    parser.add_argument('--start', default='0000', help="ISO start timestamp, e.g. 2025-09-01T00:00:00")
+    parser.add_argument('--end', default='9999', help="ISO end timestamp")
+    parser.add_argument('--speed', type=float, default=60.0, help="speed multiplier (e.g. 3600 replays an hour per second)")
+    parser.add_argument('--output', help="log file prefix for the replay output (default: <log_file_prefix>_replay)")
+    args = parser.parse_args(argv)
+
+    config = copy.deepcopy(load_config(args.config)); prefix = config['logging_options']['log_file_prefix']
+    source = args.csv or args.db or f"{prefix}.db"; output = args.output or f"{prefix}_replay"
+    if os.path.abspath(f"{output}.db") == os.path.abspath(source): print("Error: replay output must not overwrite the source database."); return 1
+    rows = load_rows_from_csv(source, args.start, args.end) if args.csv else load_rows_from_db(source, args.start, args.end)
+    if not rows: print(f"No rows found in '{source}' between {args.start} and {args.end}."); return 1
+    print(f"Replaying {len(rows)} row(s) from '{source}' at {args.speed:g}x into '{output}.db'.")
+
+    config['logging_options']['log_file_prefix'] = output
+    config['ui_options']['window_title'] = f"{config['ui_options']['window_title']} [REPLAY {args.speed:g}x]"
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    app = QApplication(sys.argv)
+    clock = ReplayClock(rows[0][0], args.speed)
+    window = MonitoringApp(config, worker_manager=ReplayWorkerManager(config, rows, clock), clock=clock, time_scale=args.speed)
+    window.show()
+    return app.exec_()
+
+if __name__ == '__main__':
+    sys.exit(main())
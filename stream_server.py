@@ -0,0 +1,153 @@
+import json, math, os, sqlite3, threading, time
+from collections import deque
+from itertools import islice
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from PyQt5.QtCore import QObject
+
+def _clean(value):
+    if isinstance(value, float) and math.isnan(value): return None
+    return value
+
+class EventHub:
+    """Ring buffer shared by all subscribers.
+
+    Publishing is O(1) and wakes nobody, no matter how many clients are connected. Every client sleeps
+    until its next flush and then reads everything since its own sequence number; a client that falls
+    further behind than the buffer skips ahead and is told how many events it lost.
+    """
+    def __init__(self, buffer_size=2000):
+        self._events = deque(maxlen=buffer_size); self._lock = threading.Lock(); self._closed = threading.Event()
+        self.last_seq = 0; self.latest = {}
+
+    @property
+    def closed(self): return self._closed.is_set()
+
+    def publish(self, key, event):
+        with self._lock:
+            self.last_seq += 1; self._events.append(event); self.latest[key] = event
+
+    def wait_events(self, after_seq, timeout):
+        """Sleeps `timeout` seconds (only close() wakes it early), then returns (events newer than after_seq, new last seq, events dropped)."""
+        if timeout > 0: self._closed.wait(timeout)
+        with self._lock:
+            first_seq = self.last_seq - len(self._events) + 1
+            dropped = max(0, first_seq - after_seq - 1)
+            events = list(islice(self._events, max(0, after_seq + 1 - first_seq), None))
+            return events, self.last_seq, dropped
+
+    def latest_values(self):
+        with self._lock: return list(self.latest.values())
+
+    def close(self): self._closed.set()
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    timeout = 30 # Socket timeout: a client that stops reading is disconnected instead of holding its thread forever
+    server_version = "HVMonitorStream/1.0"
+
+    def log_message(self, format, *args): pass
+
+    def do_GET(self):
+        url = urlparse(self.path); query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path == '/stream': self._stream(query)
+            elif url.path == '/latest': self._send_json(self.server.hub.latest_values())
+            elif url.path == '/history': self._history(query)
+            else: self.send_error(404, "Endpoints: /stream, /latest, /history")
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status); self.send_header('Content-Type', 'application/json'); self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*'); self.end_headers(); self.wfile.write(body)
+
+    def _stream(self, query):
+        """Server-sent events. Samples are coalesced per channel/sensor and flushed at most once per `interval` seconds."""
+        hub = self.server.hub
+        try: interval = max(self.server.min_interval, float(query.get('interval', self.server.min_interval)))
+        except ValueError: interval = self.server.min_interval
+        types = set(query['types'].split(',')) if 'types' in query else None
+        self.send_response(200); self.send_header('Content-Type', 'text/event-stream'); self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*'); self.end_headers()
+        seq, next_flush = hub.last_seq, time.monotonic() + interval
+        while not hub.closed:
+            events, seq, dropped = hub.wait_events(seq, next_flush - time.monotonic())
+            if hub.closed: break
+            pending = {}
+            for event in events:
+                if types is None or event['type'] in types: pending[(event['type'], event.get('ch', event.get('idx')))] = event
+            if dropped: self.wfile.write(f"event: dropped\ndata: {dropped}\n\n".encode('utf-8'))
+            if pending: self.wfile.write(f"data: {json.dumps(list(pending.values()))}\n\n".encode('utf-8'))
+            else: self.wfile.write(b": keepalive\n\n")
+            self.wfile.flush(); next_flush = time.monotonic() + interval
+
+    def _history(self, query):
+        """Range query on monitoring_data through a separate read-only connection, reduced to at most `max_points` rows.
+
+        When decimating, every bucket of `stride` consecutive rows is aggregated: the mean of each column plus
+        '<col>_min'/'<col>_max' (taken from the stored per-bucket extrema where they exist), so current spikes survive.
+        """
+        start, end = query.get('start', '0000'), query.get('end', '9999')
+        try: max_points = max(1, int(query.get('max_points', 2000)))
+        except ValueError: return self._send_json({'error': "max_points must be an integer"}, 400)
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.server.db_path)}?mode=ro", uri=True)
+        try:
+            available = [row[1] for row in conn.execute("PRAGMA table_info(monitoring_data)")]
+            columns = list(dict.fromkeys(c for c in query['columns'].split(',') if c in available and c != 'timestamp')) if 'columns' in query else available[1:]
+            count = conn.execute("SELECT COUNT(*) FROM monitoring_data WHERE timestamp BETWEEN ? AND ?", (start, end)).fetchone()[0]
+            stride = max(1, math.ceil(count / max_points))
+            if stride == 1:
+                names = ['timestamp'] + columns
+                cursor = conn.execute(f"SELECT {', '.join(names)} FROM monitoring_data WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp", (start, end))
+            else:
+                names, exprs = ['timestamp'], ["MIN(timestamp)"]
+                for c in columns:
+                    if c[-4:] in ('_min', '_max') and c[:-4] in columns: continue # Already emitted as the base column's bucket extrema
+                    if c.endswith('_min'): names.append(c); exprs.append(f"MIN({c})")
+                    elif c.endswith('_max'): names.append(c); exprs.append(f"MAX({c})")
+                    else:
+                        lo = f"COALESCE({c}_min, {c})" if f"{c}_min" in available else c
+                        hi = f"COALESCE({c}_max, {c})" if f"{c}_max" in available else c
+                        names.extend([c, f"{c}_min", f"{c}_max"]); exprs.extend([f"AVG({c})", f"MIN({lo})", f"MAX({hi})"])
+                cursor = conn.execute(f"SELECT {', '.join(exprs)} FROM (SELECT *, (ROW_NUMBER() OVER (ORDER BY timestamp) - 1) / ? AS bucket FROM monitoring_data WHERE timestamp BETWEEN ? AND ?) GROUP BY bucket ORDER BY bucket", (stride, start, end))
+            data = {name: [] for name in names}
+            for row in cursor:
+                for name, value in zip(names, row): data[name].append(value)
+        except sqlite3.Error as e:
+            return self._send_json({'error': str(e)}, 500)
+        finally:
+            conn.close()
+        self._send_json({'stride': stride, 'rows': count, 'data': data})
+
+class LiveStreamServer(QObject):
+    """Read-only HTTP server for remote viewers, fed from the WorkerManager signal stream.
+
+    The Qt slots only append to the EventHub; all encoding and socket I/O happens in the server's own
+    threads, so viewers add no work to the acquisition path or the crate.
+    """
+    def __init__(self, config, db_path, parent=None):
+        super().__init__(parent); opts = config.get('stream_server', {})
+        self.host, self.port = opts.get('host', '127.0.0.1'), opts.get('port', 8765)
+        self.hub = EventHub(opts.get('buffer_size', 2000)); self.min_interval = opts.get('min_interval', 1.0)
+        self.sensor_names = {i: s['name'] for i, s in enumerate(config['arduino_settings']['sensors'])}
+        self.db_path = db_path; self._httpd = None; self._thread = None
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _StreamHandler); self._httpd.daemon_threads = True
+        self._httpd.hub, self._httpd.db_path, self._httpd.min_interval = self.hub, self.db_path, self.min_interval
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="LiveStreamServer", daemon=True); self._thread.start()
+        print(f"Live stream server listening on http://{self.host}:{self.port}")
+
+    def stop(self):
+        if self._httpd is None: return
+        self.hub.close(); self._httpd.shutdown(); self._httpd.server_close(); self._thread.join(2); self._httpd = None
+        print("Live stream server stopped.")
+
+    def on_arduino_data(self, idx, temp, humi):
+        self.hub.publish(('env', idx), {'type': 'env', 'idx': idx, 'name': self.sensor_names.get(idx, str(idx)), 't': _clean(temp), 'h': _clean(humi), 'ts': time.time()})
+
+    def on_caenhv_data(self, results):
+        for data_dict in results:
+            event = {k: _clean(v) for k, v in data_dict.items()}; event['type'] = 'hv'; event.setdefault('ts', time.time())
+            self.hub.publish(('hv', data_dict['ch']), event)
@@ -1,3 +1,6 @@
+import time, itertools, queue
+from collections import OrderedDict
+from datetime import datetime
 from PyQt5.QtCore import QObject, pyqtSignal, QThread, QTimer
 from workers.arduino import ArduinoWorker
 from workers.caen_process import caen_worker_process
@@ -7,16 +10,25 @@ class CaenProcessBridge(QObject):
     """Reads data from the process queue and emits Qt signals."""
     data_ready = pyqtSignal(list); initial_settings_ready = pyqtSignal(dict)
     connection_status = pyqtSignal(str); command_feedback = pyqtSignal(str)
+    snapshot_ready = pyqtSignal(str, object)
+    heartbeat = pyqtSignal(); link_down = pyqtSignal(str); command_done = pyqtSignal(int)
     def __init__(self, data_q: Queue):
         super().__init__(); self.data_q = data_q
         self.timer = QTimer(self); self.timer.timeout.connect(self.check_queue); self.timer.start(100)
+    def set_queue(self, data_q: Queue): self.data_q = data_q
     def check_queue(self):
-        while not self.data_q.empty():
-            item = self.data_q.get()
+        data_q = self.data_q # The queue is swapped (and the old one closed) when the worker process is restarted
+        while True:
+            try: item = data_q.get_nowait()
+            except (queue.Empty, ValueError, OSError): break
             if item['type'] == 'data': self.data_ready.emit(item['data'])
+            elif item['type'] == 'heartbeat': self.heartbeat.emit()
             elif item['type'] == 'status': self.connection_status.emit(item['msg'])
             elif item['type'] == 'feedback': self.command_feedback.emit(item['msg'])
             elif item['type'] == 'initial_settings': self.initial_settings_ready.emit(item['data'])
+            elif item['type'] == 'snapshot': self.snapshot_ready.emit(item['ts'], item['data'])
+            elif item['type'] == 'link_down': self.link_down.emit(item['reason'])
+            elif item['type'] == 'command_done': self.command_done.emit(item['id'])
     def stop(self):
         self.timer.stop()
 
@@ -24,6 +36,7 @@ class WorkerManager(QObject):
     arduino_data_ready = pyqtSignal(int, object, object); caenhv_data_ready = pyqtSignal(list)
     arduino_status_changed = pyqtSignal(str); caenhv_status_changed = pyqtSignal(str)
     hv_command_feedback = pyqtSignal(str); hv_initial_settings_ready = pyqtSignal(dict)
+    hv_snapshot_ready = pyqtSignal(str, object); hv_outage_recorded = pyqtSignal(object)
     shutdown_complete = pyqtSignal()
 
     def __init__(self, config, parent=None):
@@ -33,30 +46,85 @@ class WorkerManager(QObject):
         self._arduino_thread.started.connect(self._arduino_worker.run)
         self._arduino_worker.data_ready.connect(self.arduino_data_ready); self._arduino_worker.connection_status.connect(self.arduino_status_changed)
         
+        # Every worker process gets its own queues; commands stay in _pending_commands until the worker acknowledges them.
         self.caen_cmd_q = Queue(); self.caen_data_q = Queue()
-        self.caen_process = Process(target=caen_worker_process, args=(self.caen_cmd_q, self.caen_data_q, config['caen_hv_settings']))
+        self._pending_commands = OrderedDict(); self._command_ids = itertools.count(1)
+        self.caen_process = self._create_caen_process()
         
         self.caen_bridge = CaenProcessBridge(self.caen_data_q); self.caen_bridge_thread = QThread()
         self.caen_bridge.moveToThread(self.caen_bridge_thread)
         self.caen_bridge.data_ready.connect(self.caenhv_data_ready); self.caen_bridge.connection_status.connect(self.caenhv_status_changed)
         self.caen_bridge.command_feedback.connect(self.hv_command_feedback); self.caen_bridge.initial_settings_ready.connect(self.hv_initial_settings_ready)
+        self.caen_bridge.snapshot_ready.connect(self.hv_snapshot_ready)
+        self.caen_bridge.data_ready.connect(self._on_caen_data); self.caen_bridge.heartbeat.connect(self._on_caen_heartbeat); self.caen_bridge.link_down.connect(self._begin_outage)
+        self.caen_bridge.command_done.connect(lambda cmd_id: self._pending_commands.pop(cmd_id, None))
         
+        hv_cfg = config['caen_hv_settings']
+        self.heartbeat_timeout = hv_cfg.get('heartbeat_timeout', 30); self.caen_restart_count = 0
+        self._last_heartbeat = time.time(); self._outage = None; self._shutdown_deadline = None
+        self.supervisor_timer = QTimer(self); self.supervisor_timer.timeout.connect(self._supervise_caen_process)
         self.shutdown_timer = QTimer(self); self.shutdown_timer.timeout.connect(self._check_shutdown_status)
 
+    def _create_caen_process(self):
+        return Process(target=caen_worker_process, args=(self.caen_cmd_q, self.caen_data_q, self.config['caen_hv_settings']), daemon=True)
+
     def start_workers(self):
         self._arduino_thread.start(); self.caen_bridge_thread.start(); self.caen_process.start()
+        self._last_heartbeat = time.time(); self.supervisor_timer.start(1000)
+
+    def _on_caen_heartbeat(self): self._last_heartbeat = time.time()
+
+    def _supervise_caen_process(self):
+        if not self.caen_process.is_alive(): reason = f"CAEN worker exited (code {self.caen_process.exitcode})"
+        elif time.time() - self._last_heartbeat > self.heartbeat_timeout: reason = f"CAEN worker unresponsive for {self.heartbeat_timeout}s"
+        else: return
+        self._restart_caen_process(reason)
+
+    def _restart_caen_process(self, reason):
+        print(f"{reason}. Restarting CAEN worker process...")
+        self.caenhv_status_changed.emit(f"HV Status: {reason}. Restarting worker...")
+        self._begin_outage(reason)
+        if self.caen_process.is_alive():
+            self.caen_process.terminate(); self.caen_process.join(2)
+            if self.caen_process.is_alive(): self.caen_process.kill(); self.caen_process.join(1)
+        # Queues shared with a terminated process may be left locked or half-written, so the new worker gets fresh ones.
+        old_queues = (self.caen_cmd_q, self.caen_data_q)
+        self.caen_cmd_q = Queue(); self.caen_data_q = Queue(); self.caen_bridge.set_queue(self.caen_data_q)
+        for q in old_queues: q.cancel_join_thread(); q.close()
+        for cmd in self._pending_commands.values(): self.caen_cmd_q.put(cmd)
+        self.caen_process = self._create_caen_process(); self.caen_process.start()
+        self._last_heartbeat = time.time(); self.caen_restart_count += 1
+
+    def _begin_outage(self, reason):
+        if self._outage is not None: return
+        self._outage = {'start': datetime.now().isoformat(), 'end': None, 'duration_s': None, 'reason': reason}
+        self.hv_outage_recorded.emit(dict(self._outage))
+
+    def _on_caen_data(self, results): self.end_outage()
+
+    def end_outage(self, note=None):
+        """Closes the open outage, if any. Called when data resumes and on shutdown so no row is left without an end."""
+        if self._outage is None: return
+        end = datetime.now()
+        self._outage.update(end=end.isoformat(), duration_s=(end - datetime.fromisoformat(self._outage['start'])).total_seconds())
+        if note: self._outage['reason'] = f"{self._outage['reason']} ({note})"
+        self.hv_outage_recorded.emit(self._outage); self._outage = None
 
     def initiate_shutdown(self):
         print("Initiating worker shutdown...")
+        self.supervisor_timer.stop(); self.end_outage("ended by shutdown")
         if self._arduino_thread.isRunning():
             self._arduino_worker.stop_polling(); self._arduino_thread.quit()
         if self.caen_process.is_alive():
             self.caen_cmd_q.put({'type': 'stop'})
         
         # Start checking if everything has shut down
+        self._shutdown_deadline = time.time() + 5
         self.shutdown_timer.start(100)
             
     def _check_shutdown_status(self):
+        if self.caen_process.is_alive() and time.time() > self._shutdown_deadline:
+            print("CAEN process did not stop in time. Terminating..."); self.caen_process.terminate(); self.caen_process.join(1)
         arduino_done = self._arduino_thread.isFinished()
         caen_done = not self.caen_process.is_alive()
 
@@ -74,5 +142,5 @@ class WorkerManager(QObject):
 
     def queue_hv_command(self, command_type, slot, ch, param_name, value):
         ch_list = [ch] if isinstance(ch, int) else ch
-        cmd = {'type': command_type, 'slot': slot, 'ch_list': ch_list, 'param_name': param_name, 'value': value}
-        self.caen_cmd_q.put(cmd)
+        cmd = {'type': command_type, 'slot': slot, 'ch_list': ch_list, 'param_name': param_name, 'value': value, 'id': next(self._command_ids)}
+        self._pending_commands[cmd['id']] = cmd; self.caen_cmd_q.put(cmd)
@@ -1,63 +1,121 @@
-import time, queue, os
+import time, queue, os, random
+from collections import deque
+from datetime import datetime
 from multiprocessing import Process, Queue
 import numpy as np
 
+def _discover_snapshot_params(device, hv, config):
+    """Returns the readable channel parameter names used for full-crate snapshots.
+
+    The monitored readbacks (VMon, IMon, ...) are left out: they change on every read and are already in monitoring_data.
+    """
+    if config.get('snapshot_parameters'): return list(config['snapshot_parameters'])
+    p = config['parameters']; readbacks = {p[k] for k in ('v_mon', 'i_mon', 'i_mon_low', 'i_mon_high') if k in p}
+    ch = config['channels_to_monitor'][0]; names = []
+    for name in device.get_ch_param_info(0, ch):
+        if name in readbacks: continue
+        try:
+            if device.get_ch_param_prop(0, ch, name).mode.name != 'WRONLY': names.append(name)
+        except hv.Error: pass
+    return names
+
+def _read_snapshot(device, hv, channels, param_names):
+    """Reads every parameter for all channels, one batched call per parameter. Failed reads are None (unknown)."""
+    snapshot = {ch: {} for ch in channels}
+    for name in param_names:
+        try: values = device.get_ch_param(0, channels, name)
+        except hv.Error: values = [None] * len(channels)
+        for ch, value in zip(channels, values): snapshot[ch][name] = value
+    return snapshot
+
+def _backoff_delay(failures, base, maximum):
+    """Jittered exponential backoff: the n-th consecutive failure waits up to base * 2**(n-1) seconds."""
+    delay = min(maximum, base * 2 ** max(failures - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+def _wait_for_commands(cmd_q, data_q, pending, delay):
+    """Sleeps for `delay` seconds while buffering commands and sending heartbeats. Returns False on 'stop'."""
+    deadline = time.time() + delay
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0: return True
+        try: cmd = cmd_q.get(timeout=min(remaining, 1.0))
+        except queue.Empty: data_q.put({'type': 'heartbeat'}); continue
+        if cmd['type'] == 'stop': return False
+        pending.append(cmd)
+
+def _execute_command(device, hv, params, cmd, data_q):
+    if cmd['type'] == 'set_param':
+        try:
+            device.set_ch_param(cmd['slot'], cmd['ch_list'], cmd['param_name'], cmd['value'])
+            data_q.put({'type': 'feedback', 'msg': f"Success: Ch{cmd['ch_list'][0]} {cmd['param_name']} set to {cmd['value']}"})
+        except hv.Error as e:
+            data_q.put({'type': 'feedback', 'msg': f"Error on Set: {e}"})
+    elif cmd['type'] == 'fetch_settings':
+        try:
+            settings = {}
+            for ch in cmd['ch_list']:
+                v_set_prop = device.get_ch_param_prop(cmd['slot'], ch, params['v_set'])
+                i_set_prop = device.get_ch_param_prop(cmd['slot'], ch, params['i_set'])
+                
+                v_val = device.get_ch_param(cmd['slot'], [ch], params['v_set'])[0] if v_set_prop.mode.name != 'WRONLY' else device.get_ch_param(cmd['slot'], [ch], params['v_mon'])[0]
+                i_val = device.get_ch_param(cmd['slot'], [ch], params['i_set'])[0] if i_set_prop.mode.name != 'WRONLY' else device.get_ch_param(0, [ch], params.get('i_mon_high', params.get('i_mon')))[0]
+                
+                settings[ch] = {'v_set': v_val, 'i_set': i_val}
+            data_q.put({'type': 'initial_settings', 'data': settings})
+        except hv.Error as e:
+             data_q.put({'type': 'feedback', 'msg': f"Error fetching settings: {e}"})
+    if 'id' in cmd: data_q.put({'type': 'command_done', 'id': cmd['id']})
+
 def caen_worker_process(cmd_q: Queue, data_q: Queue, config: dict):
     params = config['parameters']; is_dual_current = 'i_mon_low' in params
     device, hv = None, None
+    snapshot_interval = config.get('snapshot_interval', 60); snapshot_params, last_snapshot = None, 0.0
+    poll_interval = config.get('poll_interval', 2); backoff_base, backoff_max = config.get('reconnect_backoff_base', 1.0), config.get('reconnect_backoff_max', 30.0)
+    pending, failures = deque(), 0 # Commands received while disconnected wait here; WorkerManager keeps its own copy until 'command_done'
     print(f"[Process-{os.getpid()}] CAEN worker process started.")
     while True:
+        delay = poll_interval
         try:
-            if not cmd_q.empty():
-                cmd = cmd_q.get()
-                if cmd['type'] == 'stop': break
-                if device:
-                    if cmd['type'] == 'set_param':
-                        try:
-                            device.set_ch_param(cmd['slot'], cmd['ch_list'], cmd['param_name'], cmd['value'])
-                            data_q.put({'type': 'feedback', 'msg': f"Success: Ch{cmd['ch_list'][0]} {cmd['param_name']} set to {cmd['value']}"})
-                        except hv.Error as e:
-                            data_q.put({'type': 'feedback', 'msg': f"Error on Set: {e}"})
-                    elif cmd['type'] == 'fetch_settings':
-                        try:
-                            settings = {}
-                            for ch in cmd['ch_list']:
-                                v_set_prop = device.get_ch_param_prop(cmd['slot'], ch, params['v_set'])
-                                i_set_prop = device.get_ch_param_prop(cmd['slot'], ch, params['i_set'])
-                                
-                                v_val = device.get_ch_param(cmd['slot'], [ch], params['v_set'])[0] if v_set_prop.mode.name != 'WRONLY' else device.get_ch_param(cmd['slot'], [ch], params['v_mon'])[0]
-                                i_val = device.get_ch_param(cmd['slot'], [ch], params['i_set'])[0] if i_set_prop.mode.name != 'WRONLY' else device.get_ch_param(0, [ch], params.get('i_mon_high', params.get('i_mon')))[0]
-                                
-                                settings[ch] = {'v_set': v_val, 'i_set': i_val}
-                            data_q.put({'type': 'initial_settings', 'data': settings})
-                        except hv.Error as e:
-                             data_q.put({'type': 'feedback', 'msg': f"Error fetching settings: {e}"})
-
+            data_q.put({'type': 'heartbeat'})
             if device is None:
                 if not hv:
                     from caen_libs import caenhvwrapper; hv = caenhvwrapper
                 data_q.put({'type': 'status', 'msg': f"Connecting to HV ({config.get('connection_argument', '')})..."})
                 device = hv.Device.open(hv.SystemType[config['system_type']], hv.LinkType[config['link_type']], config.get('connection_argument', ''), config.get('username', ''), config.get('password', ''))
                 data_q.put({'type': 'status', 'msg': "HV Status: Connection Successful!"})
+
+            while pending: _execute_command(device, hv, params, pending.popleft(), data_q)
             
             results = []
             for ch_mon in config['channels_to_monitor']:
                 vmon = device.get_ch_param(0, [ch_mon], params['v_mon'])[0]
                 if is_dual_current:
                     imon_l = device.get_ch_param(0, [ch_mon], params['i_mon_low'])[0]; imon_h = device.get_ch_param(0, [ch_mon], params['i_mon_high'])[0]
-                    results.append({'ch': ch_mon, 'v': vmon, 'il': imon_l, 'ih': imon_h})
+                    results.append({'ch': ch_mon, 'v': vmon, 'il': imon_l, 'ih': imon_h, 'ts': time.time()})
                 else:
                     imon = device.get_ch_param(0, [ch_mon], params['i_mon'])[0]
-                    results.append({'ch': ch_mon, 'v': vmon, 'i': imon})
-            data_q.put({'type': 'data', 'data': results})
-        except hv.Error as e:
-            data_q.put({'type': 'status', 'msg': f"HV Status: Connection Failed. Retrying..."})
+                    results.append({'ch': ch_mon, 'v': vmon, 'i': imon, 'ts': time.time()})
+            data_q.put({'type': 'data', 'data': results}); failures = 0
+
+            if snapshot_interval and time.time() - last_snapshot >= snapshot_interval:
+                last_snapshot = time.time() # A failed snapshot is retried on the next interval; it never drops the link
+                try:
+                    if snapshot_params is None: snapshot_params = _discover_snapshot_params(device, hv, config)
+                    data_q.put({'type': 'snapshot', 'ts': datetime.now().isoformat(), 'data': _read_snapshot(device, hv, config['channels_to_monitor'], snapshot_params)})
+                except hv.Error as e:
+                    data_q.put({'type': 'feedback', 'msg': f"Snapshot skipped: {e}"})
+        except Exception as e:
+            # Link errors and unexpected errors both lead to a reconnect; the supervisor in WorkerManager handles hangs and crashes.
+            is_link_error = hv is not None and isinstance(e, hv.Error)
+            failures += 1; delay = _backoff_delay(failures, backoff_base, backoff_max)
+            data_q.put({'type': 'link_down', 'reason': f"HV link error: {e}" if is_link_error else f"Worker error: {e}"})
+            data_q.put({'type': 'status', 'msg': f"HV Status: Connection Failed. Retrying in {delay:.1f}s..." if is_link_error else f"Worker Error: {e}. Retrying in {delay:.1f}s..."})
             if device:
                 try: device.close()
-                except hv.Error: pass
-            device = None
-        except Exception as e: data_q.put({'type': 'status', 'msg': f"Worker Error: {e}"}); break
-        time.sleep(2)
+                except Exception: pass
+            device = None; snapshot_params = None
+        if not _wait_for_commands(cmd_q, data_q, pending, delay): break
     if device:
         try: device.close()
         except: pass